@@ -1,51 +1,78 @@
+import importlib.util
+import re
 import subprocess
 import sys
 import os
 
 # --- Dependency Installer ---
-# This block checks for required packages and installs them if they're missing.
-# This is particularly useful for environments like Cloudera where the base image
-# may not include all necessary libraries.
-try:
-    # A quick check for a primary library. If this fails, run the installer.
-    import streamlit
-except ImportError:
-    print("Required libraries not found. Installing...")
+# Opt-in (TRIALIQ_BOOTSTRAP=1): pip installs requirements.txt only while a package is missing.
+def _missing_requirements(requirements):
+    with open(requirements) as f:
+        names = [re.split(r"[\s<>=!~;\[]", line.split("#", 1)[0].strip(), maxsplit=1)[0] for line in f]
+    return [name for name in names if name and importlib.util.find_spec(name.replace("-", "_")) is None]
+
+def _bootstrap():
+    requirements = os.path.join(os.path.dirname(os.path.abspath(__file__)), "requirements.txt")
+    missing = _missing_requirements(requirements)
+    if not missing:
+        return
+    print(f"Required libraries not found ({', '.join(missing)}). Installing from requirements.txt...")
     try:
-        # Full list of dependencies from README.md
-        requirements = [
-            "fastapi", "streamlit", "sqlalchemy", "pydantic", "pandas",
-            "babel", "requests", "geopy", "uvicorn", "plotly"
-        ]
-        # Use subprocess to ensure it's run correctly.
-        subprocess.check_call([sys.executable, "-m", "pip", "install", *requirements])
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "--no-input", "-r", requirements])
+        # Let the imports below see the freshly installed packages.
+        importlib.invalidate_caches()
         print("Dependencies installed successfully.")
     except Exception as e:
         print(f"Error installing dependencies: {e}")
         # Exit if installation fails, as the app cannot run.
         sys.exit(1)
 
+if __name__ == "__main__" and os.environ.get("TRIALIQ_BOOTSTRAP"):
+    _bootstrap()
 
 import uuid
 import json
 import time
 import hashlib
+import queue
+import atexit
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from random import choice, randint, random
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+from typing import List, Dict, Any, NamedTuple, Optional, FrozenSet, Tuple
 
 import streamlit as st
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, Text
+from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, JSON, Index, select, text, event, cast, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
 import pandas as pd
-from babel import Locale
-from geopy.distance import geodesic
+import numpy as np
+from babel import Locale, UnknownLocaleError
 import requests
 import plotly.graph_objects as go
 
+# orjson when available, stdlib json otherwise; both emit compact or 2-space indented JSON.
+try:
+    import orjson
+
+    def _dumps(obj, sort_keys=False, indent=False):
+        option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj, sort_keys=False, indent=False):
+        if indent:
+            return json.dumps(obj, sort_keys=sort_keys, indent=2, ensure_ascii=False)
+        return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False)
+
+    _loads = json.loads
+
 # --- CONFIG ---
 CONFIG = {
     "AI_API_KEY": os.getenv("AI_API_KEY", "<YOUR_API_KEY>"),
@@ -73,6 +100,16 @@ CONFIG = {
 }
 DEBUG_FAKE_DATA = False
 
+# Admin map: locale country (ISO2) -> Plotly ISO-3 location code
+ISO2_TO_ISO3 = {
+    'US': 'USA', 'FR': 'FRA', 'DE': 'DEU', 'ES': 'ESP', 'IN': 'IND', 'CN': 'CHN',
+    'BR': 'BRA', 'SA': 'SAU', 'GB': 'GBR', 'CA': 'CAN', 'PT': 'PRT', 'BE': 'BEL', 'AR': 'ARG'
+}
+
+# Personal-info validators; phone numbers are up to the 15 digits E.164 allows.
+_EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+_PHONE_RE = re.compile(r"\d{7,15}")
+
 # --- UI Text & Translations ---
 UI_TEXT = {
     "app_title": {"en": "TrialIQ Multilingual Clinical Trial Matcher", "es": "TrialIQ Buscador Multilingüe de Ensayos Clínicos", "fr": "TrialIQ Chercheur Multilingue d'Essais Cliniques", "de": "TrialIQ Mehrsprachiger klinischer Studien-Matcher", "hi": "ट्रायलआईक्यू बहुभाषी क्लिनिकल परीक्षण मैचर", "zh": "TrialIQ 多语言临床试验匹配器", "pt": "TrialIQ Localizador Multilíngue de Ensaios Clínicos"},
@@ -134,19 +171,56 @@ UI_TEXT = {
     "admin_map_no_data_message": {"en": "No data for map yet.", "es": "Aún no hay datos para el mapa.", "fr": "Pas encore de données pour la carte.", "de": "Noch keine Daten für die Karte.", "hi": "मानचित्र के लिए अभी तक कोई डेटा नहीं है।", "zh": "尚无地图数据。", "pt": "Ainda não há dados para o mapa."},
     "admin_top_trials_title": {"en": "🏆 Top Matched Trials", "es": "🏆 Principales Ensayos Compatibles", "fr": "🏆 Essais les Mieux Correspondants", "de": "🏆 Top-passende Studien", "hi": "🏆 शीर्ष मिलान वाले परीक्षण", "zh": "🏆 匹配度最高的试验", "pt": "🏆 Principais Ensaios Correspondentes"},
     "admin_top_trials_drilldown_label": {"en": "Drilldown: View users for trial", "es": "Detalle: Ver usuarios por ensayo", "fr": "Détail : Voir les utilisateurs par essai", "de": "Drilldown: Benutzer für Studie anzeigen", "hi": "ड्रिलडाउन: परीक्षण के लिए उपयोगकर्ता देखें", "zh": "深入分析：查看试验的用户", "pt": "Detalhar: Ver usuários por ensaio"},
+    "admin_drilldown_show_more": {"en": "Show more", "es": "Mostrar más", "fr": "Afficher plus", "de": "Mehr anzeigen", "hi": "और दिखाएं", "zh": "显示更多", "pt": "Mostrar mais"},
     "admin_top_trials_no_matches_message": {"en": "No trial matches yet.", "es": "Aún no hay ensayos compatibles.", "fr": "Aucune correspondance d'essai pour le moment.", "de": "Noch keine Studienübereinstimmungen.", "hi": "अभी तक कोई परीक्षण मिलान नहीं हुआ है।", "zh": "尚无试验匹配。", "pt": "Ainda não há correspondências de ensaios."},
 }
 
+# --- HTML Templates ---
+WELCOME_CARD_HTML_TEMPLATE = '<div class="card" style="max-width:480px;margin:auto;"><h2>{title}</h2><p>{subtitle}</p></div>'
+CONSENT_CARD_HTML = """
+    <div class="card" style="max-width:480px;margin:auto;">
+    <h3>{title}</h3>
+    <ul>
+      <li>{item1}</li>
+      <li>{item2}</li>
+      <li>{item3}</li>
+    </ul>
+    </div>
+    """
+MATCH_CARD_HTML_TEMPLATE = """
+                    <div style='border: 1px solid #2ecc40; border-radius: 5px; padding: 10px; margin-bottom: 10px;'>
+                        <div style='display:flex;align-items:center;margin-bottom:8px;'>
+                            <i class='bi bi-patch-check-fill' style='color:#2ecc40;font-size:1.5rem;margin-right:10px;'></i>
+                            <b style='font-size:1.1rem;'>{trial_label}: {trial_id}</b>
+                        </div>
+                        <p style='margin: 5px 0; font-style:italic;'>{description}</p>
+                        <p style='margin: 5px 0;'>
+                            <b>{match_label}:</b> {pct}% | 
+                            <b>{status_label}:</b> {status} <span title='{why}'>ℹ️ {why_text}</span>
+                        </p>
+                        <a href='{next_steps}' target='_blank'>{next_steps_label}</a>
+                    </div>"""
+
 # --- Helpers (order: get_locale, translate, etc.) ---
 def get_locale(lang_code):
+    # App locales are BCP 47 style ("en-US"), hence sep="-".
     try:
-        return Locale.parse(lang_code)
-    except:
-        return Locale.parse(CONFIG["DEFAULT_LOCALE"])
+        return Locale.parse(lang_code, sep="-")
+    except (ValueError, UnknownLocaleError):
+        return Locale.parse(CONFIG["DEFAULT_LOCALE"], sep="-")
 
 def translate(text_dict, lang):
     return text_dict.get(lang, text_dict.get("en", next(iter(text_dict.values()))))
 
+# UI_TEXT resolved for one language, once per process; callers bind it as T.
+@st.cache_resource
+def ui_for(lang):
+    return {key: translate(text_dict, lang) for key, text_dict in UI_TEXT.items()}
+
+@st.cache_resource
+def trial_descriptions(lang):
+    return {t.trial_id: translate(t.descriptions, lang) for t in TRIALS}
+
 def detect_locale():
     # st.query_params is a dict-like object, not a function call
     browser_lang = st.query_params.get("lang")
@@ -159,34 +233,153 @@ def detect_locale():
         
     return st.session_state.browser_lang
 
+def _canonical_json(obj):
+    return _dumps(obj, sort_keys=True)
+
+def _user_hash(responses_json):
+    # 6-byte BLAKE2b digest == the 12 hex chars stored; pseudonymous, not a security primitive.
+    return hashlib.blake2b(responses_json.encode(), digest_size=6, usedforsecurity=False).hexdigest()
+
 # --- DB Setup (SQLite for MVP) ---
 Base = declarative_base()
 DB_URL = os.getenv("DB_URL", "sqlite:///:memory:")
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 class Submission(Base):
     __tablename__ = "trialiq_submissions"
     submission_id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id_hash = Column(String)
     locale = Column(String)
-    submitted_ts = Column(DateTime, default=datetime.utcnow)
+    submitted_ts = Column(DateTime, default=datetime.utcnow, index=True)
     input_mode = Column(String)
-    responses_json = Column(Text)
-    matches_json = Column(Text)
+    responses_json = Column(JSON)
+    matches_json = Column(JSON)
     duration_sec = Column(Float)
     status = Column(String)
-    meta_json = Column(Text)  # Renamed from 'metadata' to 'meta_json'
-
-Base.metadata.create_all(bind=engine)
+    meta_json = Column(JSON)  # Renamed from 'metadata' to 'meta_json'
+
+    # Serves the admin locale IN (...) + submitted_ts range filters.
+    __table_args__ = (Index("ix_sub_locale_ts", "locale", "submitted_ts"),)
+
+def _sqlite_pragmas(dbapi_conn, _):
+    # WAL lets admin reads run during writes; NORMAL sync skips an fsync per commit.
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-20000")
+    cur.close()
+
+# One engine per process, so the schema setup runs once.
+@st.cache_resource
+def get_engine():
+    url = make_url(DB_URL)
+    # JSON columns go through the orjson wrappers rather than stdlib json.
+    kwargs = {"connect_args": {"check_same_thread": False}, "json_serializer": _dumps, "json_deserializer": _loads}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # Share one connection, otherwise each thread gets its own empty in-memory DB.
+        kwargs["poolclass"] = StaticPool
+    engine = create_engine(url, **kwargs)
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _sqlite_pragmas)
+    Base.metadata.create_all(bind=engine)
+    # Also add missing indexes to an existing on-disk DB.
+    for index in Submission.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    return engine
+
+@st.cache_resource
+def get_sessionmaker():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+@st.cache_resource
+def get_db_lock():
+    # StaticPool shares one connection across sessions, so they must take turns.
+    return threading.RLock() if isinstance(get_engine().pool, StaticPool) else nullcontext()
+
+@contextmanager
+def db_session():
+    with get_db_lock(), get_sessionmaker()() as db:
+        yield db
+
+# Write-behind buffer: a background thread commits queued submissions in batches.
+class SubmissionWriter:
+    def __init__(self, session_factory, db_lock, batch_size=64, interval=1.0):
+        # Passed in, since the flush thread runs outside any Streamlit script.
+        self._session_factory = session_factory
+        self._db_lock = db_lock
+        self._pending = []
+        self._batch_size = batch_size
+        self._interval = interval
+        self._queue = queue.Queue()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="trialiq-submission-writer", daemon=True).start()
+        # The thread is a daemon, so write whatever is still queued on exit.
+        atexit.register(self.flush)
+
+    def put(self, row):
+        self._queue.put(row)
+        if self._queue.qsize() >= self._batch_size:
+            self._wake.set()
+
+    def flush(self):
+        # Waits for an in-flight flush, so rows queued before the call are committed.
+        with self._lock:
+            rows, self._pending = self._pending, []
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not rows:
+                return
+            try:
+                with self._db_lock, self._session_factory() as db:
+                    for i in range(0, len(rows), self._batch_size):
+                        db.execute(Submission.__table__.insert(), rows[i:i + self._batch_size])
+                    db.commit()
+            except Exception:
+                # Keep the batch (e.g. "database is locked") for the next flush.
+                self._pending = rows
+                raise
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Submission flush failed, will retry: {e}", file=sys.stderr)
+
+@st.cache_resource
+def get_submission_writer():
+    return SubmissionWriter(get_sessionmaker(), get_db_lock())
 
 # --- Mock Data ---
+# A None criterion is unspecified; a None country_set means the trial recruits globally.
+class Trial(NamedTuple):
+    trial_id: str
+    country_set: Optional[FrozenSet[str]]
+    age_min: Optional[int]
+    diabetic: Optional[bool]
+    cardiac_history: Optional[bool]
+    descriptions: Dict[str, str]
+
+class Question(NamedTuple):
+    q_id: str
+    texts: Dict[str, str]
+    answer_type: str
+    options: Tuple[str, ...] = ()
+    voice_enabled: bool = False
+    next: Optional[str] = None
+
 TRIALS = [
-    {
-        "trial_id": "NCT01007279", 
-        "country_list": ["FR", "BE", "DE"], 
-        "criteria": {"age_min": 50, "diabetic": False, "cardiac_history": True},
-        "description_dict": {
+    Trial(
+        trial_id="NCT01007279",
+        country_set=frozenset({"FR", "BE", "DE"}),
+        age_min=50, diabetic=False, cardiac_history=True,
+        descriptions={
             "en": "A study on the effects of a new drug for cardiac patients over 50.",
             "es": "Un estudio sobre los efectos de un nuevo fármaco para pacientes cardíacos mayores de 50 años.",
             "fr": "Une étude sur les effets d'un nouveau médicament pour les patients cardiaques de plus de 50 ans.",
@@ -194,13 +387,13 @@ TRIALS = [
             "hi": "50 से अधिक उम्र के हृदय रोगियों के लिए एक नई दवा के प्रभावों पर एक अध्ययन।",
             "zh": "一项关于一种新药对50岁以上心脏病患者影响的研究。",
             "pt": "Um estudo sobre os efeitos de um novo medicamento para pacientes cardíacos com mais de 50 anos."
-        }
-    },
-    {
-        "trial_id": "NCT02592421", 
-        "country_list": ["US", "CA"], 
-        "criteria": {"age_min": 18, "diabetic": False},
-        "description_dict": {
+        },
+    ),
+    Trial(
+        trial_id="NCT02592421",
+        country_set=frozenset({"US", "CA"}),
+        age_min=18, diabetic=False, cardiac_history=None,
+        descriptions={
             "en": "General wellness study for non-diabetic adults.",
             "es": "Estudio de bienestar general para adultos no diabéticos.",
             "fr": "Étude sur le bien-être général des adultes non diabétiques.",
@@ -208,13 +401,13 @@ TRIALS = [
             "hi": "गैर-मधुमेह वयस्कों के लिए सामान्य कल्याण अध्ययन।",
             "zh": "针对非糖尿病成年人的一般健康研究。",
             "pt": "Estudo de bem-estar geral para adultos não diabéticos."
-        }
-    },
-    {
-        "trial_id": "NCT99999999", 
-        "country_list": "global", 
-        "criteria": {"age_min": 21},
-        "description_dict": {
+        },
+    ),
+    Trial(
+        trial_id="NCT99999999",
+        country_set=None,
+        age_min=21, diabetic=None, cardiac_history=None,
+        descriptions={
             "en": "A global study open to all adults aged 21 and over.",
             "es": "Un estudio global abierto a todos los adultos mayores de 21 años.",
             "fr": "Une étude mondiale ouverte à tous les adultes de 21 ans et plus.",
@@ -222,42 +415,89 @@ TRIALS = [
             "hi": "21 वर्ष और उससे अधिक आयु के सभी वयस्कों के लिए एक वैश्विक अध्ययन।",
             "zh": "一项面向所有21岁及以上成年人的全球性研究。",
             "pt": "Um estudo global aberto a todos os adultos com 21 anos ou mais."
-        }
-    },
+        },
+    ),
 ]
 
+TRIALS_BY_ID = {t.trial_id: t for t in TRIALS}
+
 QUESTION_FLOW = [
-    {"q_id": "age", "text_dict": {"en": "What is your age?", "fr": "Quel âge avez-vous?", "es": "¿Cuál es su edad?"}, "answer_type": "number", "voice_enabled": True, "next": "gender"},
-    {"q_id": "gender", "text_dict": {"en": "What is your gender?", "fr": "Quel est votre genre?", "es": "¿Cuál es su género?"}, "answer_type": "select", "options": ["Male", "Female", "Other"], "voice_enabled": True, "next": "diabetic"},
-    {"q_id": "diabetic", "text_dict": {"en": "Do you have diabetes?", "fr": "Avez-vous du diabète?", "es": "¿Tiene diabetes?"}, "answer_type": "bool", "voice_enabled": True, "next": "cardiac_history"},
-    {"q_id": "cardiac_history", "text_dict": {"en": "Any history of cardiac disease?", "fr": "Antécédents de maladie cardiaque?", "es": "¿Antecedentes de enfermedad cardíaca?"}, "answer_type": "bool", "voice_enabled": True, "next": None},
+    Question("age", {"en": "What is your age?", "fr": "Quel âge avez-vous?", "es": "¿Cuál es su edad?"}, "number", voice_enabled=True, next="gender"),
+    Question("gender", {"en": "What is your gender?", "fr": "Quel est votre genre?", "es": "¿Cuál es su género?"}, "select", options=("Male", "Female", "Other"), voice_enabled=True, next="diabetic"),
+    Question("diabetic", {"en": "Do you have diabetes?", "fr": "Avez-vous du diabète?", "es": "¿Tiene diabetes?"}, "bool", voice_enabled=True, next="cardiac_history"),
+    Question("cardiac_history", {"en": "Any history of cardiac disease?", "fr": "Antécédents de maladie cardiaque?", "es": "¿Antecedentes de enfermedad cardíaca?"}, "bool", voice_enabled=True, next=None),
 ]
 
+QUESTION_IDS = tuple(q.q_id for q in QUESTION_FLOW)
+# Patient flow steps: 0 welcome, 1 consent, 2 info, one per question, then summary.
+_N_QUESTIONS = len(QUESTION_FLOW)
+_SUMMARY_STEP = 3 + _N_QUESTIONS
+
+@st.cache_resource
+def question_texts(lang):
+    return [translate(q.texts, lang) for q in QUESTION_FLOW]
+
 # --- Scoring Engine ---
 def geo_filter(trial, country):
-    if trial["country_list"] == "global" or country in trial["country_list"]:
-        return True
-    return False
-
-def score_trial(trial, responses, country):
-    if not geo_filter(trial, country):
-        return 0, "No study sites in your country"
-    score = 0
-    max_score = 5 + 3 + 1 + 2  # MVP: sum of all possible positive
-    crit = trial["criteria"]
-    if "age_min" in crit and responses.get("age", 0) >= crit["age_min"]:
-        score += CONFIG["SCORING_WEIGHTS"]["mandatory_inclusion"]
-    if "diabetic" in crit and responses.get("diabetic") == crit["diabetic"]:
-        score += CONFIG["SCORING_WEIGHTS"]["important_inclusion"]
-    if "cardiac_history" in crit and responses.get("cardiac_history") == crit["cardiac_history"]:
-        score += CONFIG["SCORING_WEIGHTS"]["soft_inclusion"]
-    score += CONFIG["SCORING_WEIGHTS"]["geo_match_bonus"]
-    pct = int((score / max_score) * 100)
-    return pct, "eligible" if pct > 0 else "ineligible"
+    return trial.country_set is None or country in trial.country_set
+
+# Scoring rules in SCORE_WEIGHTS order: (Trial field, answer key, comparison).
+SCORING_CRITERIA = (
+    ("age_min", "age", ">="),
+    ("diabetic", "diabetic", "=="),
+    ("cardiac_history", "cardiac_history", "=="),
+)
+
+def _flag(value):
+    # A missing answer never matches, not even the -1 "no criterion" sentinel.
+    return -2 if value is None else int(value)
+
+def _answer_codes(responses):
+    # One respondent's answers as integers, aligned with SCORING_CRITERIA.
+    return [responses.get(key, 0) if op == ">=" else _flag(responses.get(key)) for _, key, op in SCORING_CRITERIA]
+
+# Struct-of-arrays view of TRIALS for batch scoring; -1 marks an unspecified criterion.
+TRIAL_IDS = [t.trial_id for t in TRIALS]
+TRIAL_CRITERIA = np.array(
+    [[-1 if getattr(t, field) is None else int(getattr(t, field)) for field, _, _ in SCORING_CRITERIA] for t in TRIALS],
+    dtype=np.int16,
+).reshape(len(TRIALS), len(SCORING_CRITERIA))
+_CRITERION_IS_GE = np.array([op == ">=" for _, _, op in SCORING_CRITERIA])
+TRIAL_GLOBAL = np.array([t.country_set is None for t in TRIALS])
+# (n_trials, n_countries) site matrix, global trials included.
+COUNTRY_INDEX = {c: i for i, c in enumerate(sorted({c for t in TRIALS if t.country_set is not None for c in t.country_set}))}
+TRIAL_COUNTRY_MASK = np.array([[geo_filter(t, c) for c in COUNTRY_INDEX] for t in TRIALS], dtype=bool).reshape(len(TRIALS), len(COUNTRY_INDEX))
+# Feature order: SCORING_CRITERIA, then geo match
+SCORE_WEIGHTS = np.array([
+    CONFIG["SCORING_WEIGHTS"]["mandatory_inclusion"],
+    CONFIG["SCORING_WEIGHTS"]["important_inclusion"],
+    CONFIG["SCORING_WEIGHTS"]["soft_inclusion"],
+    CONFIG["SCORING_WEIGHTS"]["geo_match_bonus"],
+], dtype=np.float64)
+MAX_SCORE = 5 + 3 + 1 + 2  # MVP: sum of all possible positive
+
+# Site matrix plus a column for countries no trial lists.
+_GEO_MASK = np.column_stack((TRIAL_COUNTRY_MASK, TRIAL_GLOBAL))
+
+def score_trials_batch(answers, countries):
+    """Score N respondents (rows of _answer_codes) against every trial; returns (N, n_trials) pct and status arrays."""
+    answers = np.asarray(answers).reshape(-1, 1, len(SCORING_CRITERIA))
+    met = (TRIAL_CRITERIA >= 0) & np.where(_CRITERION_IS_GE, answers >= TRIAL_CRITERIA, answers == TRIAL_CRITERIA)
+    geo_ok = _GEO_MASK[:, [COUNTRY_INDEX.get(c, len(COUNTRY_INDEX)) for c in countries]].T
+    feats = np.concatenate((met, np.ones(met.shape[:2] + (1,), dtype=bool)), axis=-1)
+    scores = feats @ SCORE_WEIGHTS
+    pct = np.where(geo_ok, (scores / MAX_SCORE * 100).astype(int), 0)
+    status = np.where(geo_ok, np.where(pct > 0, "eligible", "ineligible"), "No study sites in your country")
+    return pct, status
+
+def score_all_trials(responses, country):
+    """Score one respondent against every trial; returns (pct, status) lists aligned with TRIALS."""
+    pct, status = score_trials_batch([_answer_codes(responses)], [country])
+    return pct[0].tolist(), status[0].tolist()
 
 # --- Streamlit UI ---
 st.set_page_config(page_title="TrialIQ Clinical Trial Matcher", layout="centered")
-# Load icon CDN
+# Load icon CDN (re-sent every rerun; the frontend doesn't re-fetch it)
 st.markdown(CONFIG["ICON_CDN"], unsafe_allow_html=True)
 
 # --- Locale Detection is now done inside the run_patient_flow and other relevant places ---
@@ -273,13 +513,18 @@ st.query_params["theme"] = "dark"
 if "lang" not in st.session_state:
     st.session_state.lang = CONFIG["DEFAULT_LOCALE"].split("-")[0]
 
+# Resolve the browser locale once per rerun.
+LOCALE = detect_locale()
+LOCALE_LANG = LOCALE.split("-", 1)[0]
+LOCALE_COUNTRY = LOCALE.rsplit("-", 1)[-1]
+
 lang_names = {"en": "English", "es": "Español", "fr": "Français", "de": "Deutsch", "hi": "हिन्दी", "zh": "中文", "pt": "Português"}
 # Limit languages to 7
 supported_langs = ["en", "es", "fr", "de", "hi", "zh", "pt"]
-lang = st.sidebar.selectbox("Language", supported_langs, format_func=lambda l: f"{lang_names.get(l, l)}", index=supported_langs.index(st.session_state.get("lang", detect_locale().split("-")[0])), key="lang_select")
+lang = st.sidebar.selectbox("Language", supported_langs, format_func=lambda l: f"{lang_names.get(l, l)}", index=supported_langs.index(st.session_state.get("lang", LOCALE_LANG)), key="lang_select")
 if lang != st.session_state.get("lang"):
     st.session_state.lang = lang
-    st.session_state.browser_lang = f"{lang}-{detect_locale().split('-')[-1]}"
+    st.session_state.browser_lang = f"{lang}-{LOCALE_COUNTRY}"
     st.rerun()
 
 menu = st.sidebar.selectbox("Menu", ["Patient", "Admin"], key="main_menu")
@@ -287,7 +532,7 @@ menu = st.sidebar.selectbox("Menu", ["Patient", "Admin"], key="main_menu")
 # --- Progress Bar Helper ---
 def show_progress():
     step = st.session_state.get("step", 0)
-    total_steps = 4 + len(QUESTION_FLOW)  # 0:welcome, 1:consent, 2:info, rest:questions, summary
+    total_steps = _SUMMARY_STEP + 1  # 0:welcome, 1:consent, 2:info, rest:questions, summary
     color = "#2b6cb0" if st.session_state.theme == "dark" else "#3182ce"
     if step == 'results':
         pct = 1.0
@@ -297,26 +542,40 @@ def show_progress():
 
 # --- Consent Step ---
 def consent_card(lang):
-    card = f"""
-    <div class="card" style="max-width:480px;margin:auto;">
-    <h3>{translate(UI_TEXT['consent_title'], lang)}</h3>
-    <ul>
-      <li>{translate(UI_TEXT['consent_item1'], lang)}</li>
-      <li>{translate(UI_TEXT['consent_item2'], lang)}</li>
-      <li>{translate(UI_TEXT['consent_item3'], lang)}</li>
-    </ul>
-    </div>
-    """
+    T = ui_for(lang)
+    card = CONSENT_CARD_HTML.format(
+        title=T['consent_title'],
+        item1=T['consent_item1'],
+        item2=T['consent_item2'],
+        item3=T['consent_item3'],
+    )
     st.markdown(card, unsafe_allow_html=True)
     col1, col2 = st.columns([2,1])
-    agree = col1.button(translate(UI_TEXT['agree_button'], lang), key="agree_btn")
-    decline = col2.button(translate(UI_TEXT['decline_button'], lang), key="decline_btn")
+    agree = col1.button(T['agree_button'], key="agree_btn")
+    decline = col2.button(T['decline_button'], key="decline_btn")
     return agree, decline
 
+def _match_card_html(lang, trial_id, pct, status, why, description, next_steps):
+    T = ui_for(lang)
+    return MATCH_CARD_HTML_TEMPLATE.format(
+        trial_label=T['results_trial_label'],
+        trial_id=trial_id,
+        description=description,
+        match_label=T['results_match_label'],
+        pct=pct,
+        status_label=T['results_status_label'],
+        status=status,
+        why=why,
+        why_text=T['results_why_tooltip'],
+        next_steps=next_steps,
+        next_steps_label=T['results_next_steps_label'],
+    )
+
 # --- Patient Flow ---
 def run_patient_flow():
-    locale = detect_locale()
-    lang = st.session_state.get("lang", detect_locale().split("-")[0])
+    locale = LOCALE
+    lang = st.session_state.get("lang", LOCALE_LANG)
+    T = ui_for(lang)
     if "step" not in st.session_state:
         st.session_state.step = 0
     if "responses" not in st.session_state:
@@ -325,43 +584,28 @@ def run_patient_flow():
         st.session_state.results = {}
     step = st.session_state.step
     responses = st.session_state.responses
-    st.title(translate(UI_TEXT['app_title'], lang))
+    st.title(T['app_title'])
     show_progress()
 
     # Results page (check first to avoid TypeError on rerun)
     if step == 'results':
         if 'results' in st.session_state:
             results = st.session_state['results']
-            st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><b>{translate(UI_TEXT["matched_trials_title"], lang)}</b></div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><b>{T["matched_trials_title"]}</b></div>', unsafe_allow_html=True)
             if results.get('matches'):
+                age_req_text = T['results_met_age_req']
+                descriptions = trial_descriptions(lang)
+                # One markdown element for all cards; stripped so the joined HTML stays one block.
+                cards = []
                 for m in results['matches']:
-                    why_text = translate(UI_TEXT['results_why_tooltip'], lang)
-                    age_req_text = translate(UI_TEXT['results_met_age_req'], lang)
-                    why = f"{age_req_text} ≥" + str([t['criteria']['age_min'] for t in TRIALS if t['trial_id']==m['trial_id']][0]) if m['status']=="eligible" else ""
-                    
-                    # Find trial details to get the description
-                    trial_details = next((t for t in TRIALS if t['trial_id'] == m['trial_id']), None)
-                    description = ""
-                    if trial_details:
-                        description = translate(trial_details.get('description_dict', {}), lang)
-
-                    card_html = f"""
-                    <div style='border: 1px solid #2ecc40; border-radius: 5px; padding: 10px; margin-bottom: 10px;'>
-                        <div style='display:flex;align-items:center;margin-bottom:8px;'>
-                            <i class='bi bi-patch-check-fill' style='color:#2ecc40;font-size:1.5rem;margin-right:10px;'></i>
-                            <b style='font-size:1.1rem;'>{translate(UI_TEXT['results_trial_label'], lang)}: {m['trial_id']}</b>
-                        </div>
-                        <p style='margin: 5px 0; font-style:italic;'>{description}</p>
-                        <p style='margin: 5px 0;'>
-                            <b>{translate(UI_TEXT['results_match_label'], lang)}:</b> {m['match_percentage']}% | 
-                            <b>{translate(UI_TEXT['results_status_label'], lang)}:</b> {m['status']} <span title='{why}'>ℹ️ {why_text}</span>
-                        </p>
-                        <a href='{m['next_steps']}' target='_blank'>{translate(UI_TEXT['results_next_steps_label'], lang)}</a>
-                    </div>"""
-                    st.markdown(card_html, unsafe_allow_html=True)
+                    trial_details = TRIALS_BY_ID.get(m['trial_id'])
+                    why = f"{age_req_text} ≥{trial_details.age_min}" if m['status']=="eligible" else ""
+                    description = descriptions.get(m['trial_id'], "")
+                    cards.append(_match_card_html(lang, m['trial_id'], m['match_percentage'], m['status'], why, description, m['next_steps']).strip())
+                st.markdown("\n".join(cards), unsafe_allow_html=True)
             else:
-                st.warning(translate(UI_TEXT['no_trials_found'], lang), icon='⚠️')
-            if st.button(translate(UI_TEXT['start_over_button'], lang)):
+                st.warning(T['no_trials_found'], icon='⚠️')
+            if st.button(T['start_over_button']):
                 st.session_state.step = 0
                 st.session_state.responses = {}
                 st.session_state.results = {}
@@ -370,8 +614,8 @@ def run_patient_flow():
 
     # Step 0: Welcome
     if step == 0:
-        st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><h2>{translate(UI_TEXT["app_title"], lang)}</h2><p>{translate(UI_TEXT["welcome_subtitle"], lang)}</p></div>', unsafe_allow_html=True)
-        if st.button(translate(UI_TEXT['start_button'], lang), key="start_btn"):
+        st.markdown(WELCOME_CARD_HTML_TEMPLATE.format(title=T["app_title"], subtitle=T["welcome_subtitle"]), unsafe_allow_html=True)
+        if st.button(T['start_button'], key="start_btn"):
             st.session_state.step = 1
             st.rerun()
         return
@@ -382,26 +626,26 @@ def run_patient_flow():
             st.session_state.step = 2
             st.rerun()
         if decline:
-            st.markdown(f"<div class='card' style='max-width:480px;margin:auto;'><b>{translate(UI_TEXT['decline_message'], lang)}</b></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='card' style='max-width:480px;margin:auto;'><b>{T['decline_message']}</b></div>", unsafe_allow_html=True)
             st.stop()
         return
     # Step 2: Personal Info
     if step == 2:
         with st.form("personal_info_form", clear_on_submit=False):
-            st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><h3>{translate(UI_TEXT["personal_info_title"], lang)}</h3></div>', unsafe_allow_html=True)
-            name = st.text_input(translate(UI_TEXT['name_label'], lang), value=responses.get("name", ""))
-            phone = st.text_input(translate(UI_TEXT['phone_label'], lang), value=responses.get("phone", ""))
-            email = st.text_input(translate(UI_TEXT['email_label'], lang), value=responses.get("email", ""))
-            id_doc = st.text_input(translate(UI_TEXT['id_doc_label'], lang), value=responses.get("id_doc", ""))
-            submitted = st.form_submit_button(translate(UI_TEXT['next_button'], lang))
+            st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><h3>{T["personal_info_title"]}</h3></div>', unsafe_allow_html=True)
+            name = st.text_input(T['name_label'], value=responses.get("name", ""))
+            phone = st.text_input(T['phone_label'], value=responses.get("phone", ""))
+            email = st.text_input(T['email_label'], value=responses.get("email", ""))
+            id_doc = st.text_input(T['id_doc_label'], value=responses.get("id_doc", ""))
+            submitted = st.form_submit_button(T['next_button'])
             error = ""
             if submitted:
                 if not name or not phone or not email or not id_doc:
-                    error = translate(UI_TEXT['error_all_fields_required'], lang)
-                elif "@" not in email or "." not in email:
-                    error = translate(UI_TEXT['error_invalid_email'], lang)
-                elif not phone.isdigit() or len(phone) < 7:
-                    error = translate(UI_TEXT['error_invalid_phone'], lang)
+                    error = T['error_all_fields_required']
+                elif not _EMAIL_RE.fullmatch(email):
+                    error = T['error_invalid_email']
+                elif not _PHONE_RE.fullmatch(phone):
+                    error = T['error_invalid_phone']
                 else:
                     responses["name"] = name
                     responses["phone"] = phone
@@ -412,35 +656,35 @@ def run_patient_flow():
                     st.rerun()
             if error:
                 st.error(error)
-            if st.form_submit_button(translate(UI_TEXT['back_button'], lang)):
+            if st.form_submit_button(T['back_button']):
                 st.session_state.step = 1
                 st.rerun()
         return
     # Step 3+: Eligibility Questions
     q_idx = step - 3
-    if isinstance(q_idx, int) and 0 <= q_idx < len(QUESTION_FLOW):
+    if 0 <= q_idx < _N_QUESTIONS:
         q = QUESTION_FLOW[q_idx]
-        qtext = translate(q["text_dict"], lang)
-        with st.form(f"q_form_{q['q_id']}", clear_on_submit=False):
+        qtext = question_texts(lang)[q_idx]
+        with st.form(f"q_form_{q.q_id}", clear_on_submit=False):
             st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><b>{qtext}</b></div>', unsafe_allow_html=True)
-            key = f"q_{q['q_id']}"
-            val = responses.get(q["q_id"])
-            if q["answer_type"] == "number":
-                label = translate(UI_TEXT['age_label'], lang)
+            key = f"q_{q.q_id}"
+            val = responses.get(q.q_id)
+            if q.answer_type == "number":
+                label = T['age_label']
                 val = st.number_input(label, min_value=0, max_value=120, step=1, key=key, value=val if val is not None else 0)
                 if val < 0:
-                    st.error(translate(UI_TEXT['age_error_negative'], lang))
-            elif q["answer_type"] == "select":
-                val = st.selectbox(translate(UI_TEXT['select_option_label'], lang), q.get("options", []), key=key, index=q.get("options", []).index(val) if val in q.get("options", []) else 0)
-            elif q["answer_type"] == "bool":
-                val = st.radio(translate(UI_TEXT['radio_select_one'], lang), [True, False], key=key, format_func=lambda x: translate(UI_TEXT['radio_yes'], lang) if x else translate(UI_TEXT['radio_no'], lang), index=0 if val is None or val else 1)
-            submitted = st.form_submit_button(translate(UI_TEXT['next_button'], lang))
+                    st.error(T['age_error_negative'])
+            elif q.answer_type == "select":
+                val = st.selectbox(T['select_option_label'], q.options, key=key, index=q.options.index(val) if val in q.options else 0)
+            elif q.answer_type == "bool":
+                val = st.radio(T['radio_select_one'], [True, False], key=key, format_func=lambda x: T['radio_yes'] if x else T['radio_no'], index=0 if val is None or val else 1)
+            submitted = st.form_submit_button(T['next_button'])
             if submitted:
-                responses[q["q_id"]] = val
+                responses[q.q_id] = val
                 st.session_state.responses = responses
                 st.session_state.step += 1
                 st.rerun()
-            if st.form_submit_button(translate(UI_TEXT['back_button'], lang)):
+            if st.form_submit_button(T['back_button']):
                 if step == 3:
                     st.session_state.step = 2
                 else:
@@ -448,127 +692,251 @@ def run_patient_flow():
                 st.rerun()
         return
     # Summary and submit
-    if step == 3 + len(QUESTION_FLOW):
-        st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><h3>{translate(UI_TEXT["summary_title"], lang)}</h3></div>', unsafe_allow_html=True)
-        # Display personal info
-        for key in ["name", "phone", "email", "id_doc"]:
-            label = translate(UI_TEXT[f'{key}_label'], lang)
-            st.write(f"**{label}**: {responses.get(key, translate(UI_TEXT['not_applicable'], lang))}")
-        # Display question answers
-        for q in QUESTION_FLOW:
-            q_text = translate(q['text_dict'], lang)
-            st.write(f"**{q_text}**: {responses.get(q['q_id'], translate(UI_TEXT['not_applicable'], lang))}")
-        
+    if step == _SUMMARY_STEP:
+        st.markdown(f'<div class="card" style="max-width:480px;margin:auto;"><h3>{T["summary_title"]}</h3></div>', unsafe_allow_html=True)
+        # Personal info and answers as one plain-markdown element (values are user input).
+        na = T['not_applicable']
+        rows = [f"**{T[f'{key}_label']}**: {responses.get(key, na)}" for key in ("name", "phone", "email", "id_doc")]
+        rows += [f"**{q_text}**: {responses.get(q_id, na)}" for q_id, q_text in zip(QUESTION_IDS, question_texts(lang))]
+        st.markdown("  \n".join(rows))
+
         col1, col2 = st.columns(2)
-        if col1.button(translate(UI_TEXT['submit_button'], lang)):
-            with st.spinner(translate(UI_TEXT['spinner_eligibility'], lang)):
+        if col1.button(T['submit_button']):
+            with st.spinner(T['spinner_eligibility']):
                 submit_patient(responses, locale)
             st.rerun()
-        if col2.button(translate(UI_TEXT['back_button'], lang)):
+        if col2.button(T['back_button']):
             st.session_state.step -= 1
             st.rerun()
         return
 
 def submit_patient(responses, locale):
-    user_id_hash = hashlib.sha256(str(responses).encode()).hexdigest()[:12]
+    user_id_hash = _user_hash(_canonical_json(responses))
     input_mode = "text"
     start = time.time()
     matches = []
     ineligible = []
     country = locale.split("-")[-1]
-    for trial in TRIALS:
-        pct, status = score_trial(trial, responses, country)
+    pcts, statuses = score_all_trials(responses, country)
+    for trial_id, pct, status in zip(TRIAL_IDS, pcts, statuses):
         if pct > 0:
-            matches.append({"trial_id": trial["trial_id"], "country_site": country, "match_percentage": pct, "status": status, "next_steps": f"https://apply.example/{trial['trial_id'][-3:]}_{country.lower()}"})
+            matches.append({"trial_id": trial_id, "country_site": country, "match_percentage": pct, "status": status, "next_steps": f"https://apply.example/{trial_id[-3:]}_{country.lower()}"})
         else:
-            ineligible.append({"trial_id": trial["trial_id"], "reason": status})
+            ineligible.append({"trial_id": trial_id, "reason": status})
     duration = time.time() - start
-    with SessionLocal() as db:
-        sub = Submission(
-            user_id_hash=user_id_hash,
-            locale=locale,
-            input_mode=input_mode,
-            responses_json=json.dumps(responses),
-            matches_json=json.dumps(matches),
-            duration_sec=duration,
-            status="complete",
-            meta_json=json.dumps({"ineligible_trials": ineligible})
-        )
-        db.add(sub)
-        db.commit()
+    get_submission_writer().put({
+        "submission_id": str(uuid.uuid4()),
+        "user_id_hash": user_id_hash,
+        "locale": locale,
+        "submitted_ts": datetime.utcnow(),
+        "input_mode": input_mode,
+        "responses_json": responses,
+        "matches_json": matches,
+        "duration_sec": duration,
+        "status": "complete",
+        "meta_json": {"ineligible_trials": ineligible},
+    })
     st.session_state['results'] = {
         'matches': matches,
         'ineligible': ineligible
     }
     st.session_state['step'] = 'results'
 
+# Fixed seed so the demo dataset looks the same on every fresh start.
+_RNG = np.random.default_rng(42)
+
 def inject_synthetic_data(db, n=50):
-    # Only inject if table is empty
-    if db.query(Submission).count() > 0:
+    # Only inject if table is empty; LIMIT 1 stops at the first row instead of counting them all
+    if db.execute(select(Submission.submission_id).limit(1)).first() is not None:
         return
     locales = ["en-US", "fr-FR", "de-DE", "es-ES", "hi-IN", "zh-CN", "pt-BR", "ar-SA", "en-GB", "ca-CA"]
     names = ["Alice", "Bob", "Carlos", "Diana", "Eva", "Faisal", "Gita", "Hao", "Ines", "Jorge"]
     emails = [f"{n.lower()}@demo.com" for n in names]
-    for i in range(n):
-        locale = choice(locales)
-        name = choice(names)
-        phone = str(randint(1000000000, 9999999999))
-        email = choice(emails)
-        id_doc = str(randint(10000, 99999))
+    # Draw every random column in one batch; .tolist() yields plain Python values.
+    locale_arr = _RNG.choice(locales, size=n).tolist()
+    name_arr = _RNG.choice(names, size=n).tolist()
+    phone_arr = _RNG.integers(1000000000, 10000000000, size=n).astype(str).tolist()
+    email_arr = _RNG.choice(emails, size=n).tolist()
+    id_doc_arr = _RNG.integers(10000, 100000, size=n).astype(str).tolist()
+    age_arr = _RNG.integers(18, 81, size=n).tolist()
+    gender_arr = _RNG.choice(["male", "female", "other"], size=n).tolist()
+    diabetic_arr = _RNG.integers(0, 2, size=n).astype(bool).tolist()
+    cardiac_arr = _RNG.integers(0, 2, size=n).astype(bool).tolist()
+    duration_arr = np.round(_RNG.random(size=n) * 10 + 5, 2).tolist()
+    ts_offsets = _RNG.integers(0, 31, size=n).tolist()
+    now = datetime.utcnow()
+    # Score all n synthetic respondents against every trial in one pass.
+    country_arr = [locale.rsplit("-", 1)[-1] for locale in locale_arr]
+    answers = [_answer_codes({"age": a, "diabetic": d, "cardiac_history": c}) for a, d, c in zip(age_arr, diabetic_arr, cardiac_arr)]
+    pct_rows, status_rows = score_trials_batch(answers, country_arr)
+    pct_rows, status_rows = pct_rows.tolist(), status_rows.tolist()
+    # Plain dicts fed to one executemany INSERT; no ORM objects or per-row flush.
+    rows = []
+    for locale, country, pcts, statuses, name, phone, email, id_doc, age, gender, diabetic, cardiac_history, duration, days_ago in zip(
+        locale_arr, country_arr, pct_rows, status_rows, name_arr, phone_arr, email_arr, id_doc_arr, age_arr, gender_arr, diabetic_arr, cardiac_arr, duration_arr, ts_offsets
+    ):
         responses = {
             "name": name,
             "phone": phone,
             "email": email,
             "id_doc": id_doc,
-            "age": randint(18, 80),
-            "gender": choice(["male", "female", "other"]),
-            "diabetic": choice([True, False]),
-            "cardiac_history": choice([True, False])
+            "age": age,
+            "gender": gender,
+            "diabetic": diabetic,
+            "cardiac_history": cardiac_history
         }
+        user_id_hash = _user_hash(_canonical_json(responses))
         matches = []
         ineligible = []
-        country = locale.split("-")[-1]
-        for trial in TRIALS:
-            pct, status = score_trial(trial, responses, country)
+        for trial_id, pct, status in zip(TRIAL_IDS, pcts, statuses):
             if pct > 0:
-                matches.append({"trial_id": trial["trial_id"], "country_site": country, "match_percentage": pct, "status": status, "next_steps": f"https://apply.example/{trial['trial_id'][-3:]}_{country.lower()}"})
+                matches.append({"trial_id": trial_id, "country_site": country, "match_percentage": pct, "status": status, "next_steps": f"https://apply.example/{trial_id[-3:]}_{country.lower()}"})
             else:
-                ineligible.append({"trial_id": trial["trial_id"], "reason": status})
-        sub = Submission(
-            user_id_hash=hashlib.sha256(str(responses).encode()).hexdigest()[:12],
-            locale=locale,
-            input_mode="text",
-            responses_json=json.dumps(responses),
-            matches_json=json.dumps(matches),
-            duration_sec=round(random()*10+5,2),
-            status="complete",
-            meta_json=json.dumps({"ineligible_trials": ineligible}),
-            submitted_ts=datetime.utcnow() - timedelta(days=randint(0, 30))
-        )
-        db.add(sub)
+                ineligible.append({"trial_id": trial_id, "reason": status})
+        rows.append({
+            "submission_id": str(uuid.uuid4()),
+            "user_id_hash": user_id_hash,
+            "locale": locale,
+            "input_mode": "text",
+            "responses_json": responses,
+            "matches_json": matches,
+            "duration_sec": duration,
+            "status": "complete",
+            "meta_json": {"ineligible_trials": ineligible},
+            "submitted_ts": now - timedelta(days=days_ago)
+        })
+    db.execute(Submission.__table__.insert(), rows)
     db.commit()
 
+# The admin queries skip responses_json; _load_responses fetches it for the drilldown.
+_ADMIN_OVERVIEW_COLUMNS = (Submission.submission_id, Submission.locale, Submission.submitted_ts, Submission.duration_sec, Submission.status, Submission.matches_json)
+_ADMIN_TABLE_COLUMNS = tuple(c for c in Submission.__table__.c if c.name != "responses_json")
+
+def _add_derived_columns(df):
+    df["trial_ids"] = df["matches_json"].apply(lambda ms: [m["trial_id"] for m in ms])
+    df["country"] = df["locale"].fillna(CONFIG["DEFAULT_LOCALE"]).str.rsplit("-", n=1).str[-1]
+    return df
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _load_admin_df(data_version):
+    # data_version in the cache key invalidates the frame when the table changes.
+    with db_session() as db:
+        chunks = pd.read_sql(select(*_ADMIN_OVERVIEW_COLUMNS), db.bind, chunksize=5000)
+        df = _add_derived_columns(pd.concat(chunks, ignore_index=True))
+    # country -> locales, so the country filter is an indexed locale IN (...).
+    locales = df[["country", "locale"]].dropna().drop_duplicates().sort_values(["country", "locale"])
+    country_locales = {country: tuple(group["locale"]) for country, group in locales.groupby("country", sort=True)}
+    trial_opts = sorted(df["trial_ids"].explode().dropna().unique())
+    return df, country_locales, trial_opts
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _query_submissions(data_version, locales, trial_f, date_f):
+    # Filters run as SQL WHERE clauses; returns the frame and a trial_id -> row positions index.
+    stmt = select(*_ADMIN_TABLE_COLUMNS).where(
+        Submission.submitted_ts >= datetime.combine(date_f[0], datetime.min.time()),
+        Submission.submitted_ts < datetime.combine(date_f[1] + timedelta(days=1), datetime.min.time()),
+    )
+    if locales is not None:
+        stmt = stmt.where(Submission.locale.in_(locales))
+    if trial_f != "All":
+        if get_engine().dialect.name == "sqlite":
+            stmt = stmt.where(text("EXISTS (SELECT 1 FROM json_each(matches_json) WHERE json_extract(value, '$.trial_id') = :trial_id)").bindparams(trial_id=trial_f))
+        else:
+            stmt = stmt.where(cast(Submission.matches_json, String).like(f'%"{trial_f}"%'))
+    with db_session() as db:
+        result = db.execute(stmt)
+        df = _add_derived_columns(pd.DataFrame(result.all(), columns=list(result.keys())))
+    trial_rows = defaultdict(list)
+    for i, ids in enumerate(df["trial_ids"]):
+        for trial_id in ids:
+            trial_rows[trial_id].append(i)
+    return df, dict(trial_rows)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _load_responses(submission_ids):
+    # One IN query per drilldown page, returning pretty-printed responses.
+    with db_session() as db:
+        rows = db.execute(select(Submission.submission_id, Submission.responses_json).where(Submission.submission_id.in_(submission_ids)))
+        return {submission_id: _dumps(responses, indent=True) for submission_id, responses in rows}
+
+# Drilldown rows rendered per page; "Show more" adds another page.
+_DRILL_PAGE = 25
+
+def _show_more_drilldown():
+    st.session_state._drill_limit += _DRILL_PAGE
+
 def run_admin(lang):
-    st.header(translate(UI_TEXT['admin_dashboard_title'], lang))
-    secret = st.text_input(translate(UI_TEXT['admin_secret_label'], lang), type="password")
+    T = ui_for(lang)
+    st.header(T['admin_dashboard_title'])
+    secret = st.text_input(T['admin_secret_label'], type="password")
     if secret != CONFIG["ADMIN_BEARER_SECRET"]:
-        st.warning(translate(UI_TEXT['admin_secret_warning'], lang))
+        st.warning(T['admin_secret_warning'])
         return
-    with SessionLocal() as db:
-        inject_synthetic_data(db)
-        df = pd.read_sql("SELECT * FROM trialiq_submissions", db.bind)
+    # Write out queued submissions first so the dashboard includes them.
+    get_submission_writer().flush()
+    with db_session() as db:
+        # Seed check at most once per admin session, not on every widget rerun.
+        if not st.session_state.get("_seeded"):
+            inject_synthetic_data(db)
+            st.session_state._seeded = True
+        # Index-only count/min/max: (count, max) is the cache key, min/max the slider bounds.
+        total, ts_min, ts_max = db.execute(select(func.count(), func.min(Submission.submitted_ts), func.max(Submission.submitted_ts)).select_from(Submission)).one()
+    data_version = (total, ts_max)
+    df, country_locales, trial_opts = _load_admin_df(data_version)
+    date_min = ts_min or datetime.utcnow()
+    date_max = ts_max or datetime.utcnow()
+    if date_min == date_max:
+        date_max = date_min + timedelta(days=1)
+    _admin_panel(lang, data_version, df, country_locales, trial_opts, date_min, date_max)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _build_map_figure(country_counts, lang, theme):
+    # Keyed on (country, count) pairs, so unrelated reruns reuse the figure.
+    T = ui_for(lang)
+    countries = [c for c, _ in country_counts]
+    counts = [n for _, n in country_counts]
+    max_cnt = max(counts)
+    fig = go.Figure(data=go.Scattergeo(
+        locations=[ISO2_TO_ISO3.get(c) for c in countries],
+        locationmode='ISO-3',
+        text=[f"{c}: {n} {T['admin_map_hover_text']}" for c, n in country_counts],
+        marker=dict(
+            size=counts,
+            sizemin=4,
+            sizemode='diameter',
+            color='#3182ce' if theme == 'light' else '#2b6cb0',
+            line_width=0.5,
+            line_color='rgb(40,40,40)',
+            sizeref=max_cnt / 50 if max_cnt > 0 else 1,
+        ),
+        hoverinfo='text'
+    ))
+
+    fig.update_layout(
+        title=T['admin_map_plot_title'],
+        geo=dict(
+            scope='world',
+            projection_type='natural earth',
+            showland=True,
+            landcolor='rgb(217, 217, 217)' if theme == 'light' else 'rgb(40, 40, 40)',
+            subunitcolor='rgb(255, 255, 255)' if theme == 'light' else 'rgb(80, 80, 80)',
+            bgcolor='rgba(0,0,0,0)',
+        ),
+        margin={"r":0,"t":40,"l":0,"b":0},
+        template='plotly_white' if theme == 'light' else 'plotly_dark'
+    )
+    return fig
+
+# Rerun only the admin panel on filter changes (st.fragment, Streamlit >= 1.33); older versions just call it.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+@_fragment
+def _admin_panel(lang, data_version, df, country_locales, trial_opts, date_min, date_max):
+    T = ui_for(lang)
     # --- Filters ---
     st.markdown("---")
-    st.subheader(translate(UI_TEXT['admin_filters_title'], lang))
+    st.subheader(T['admin_filters_title'])
     filter_col1, filter_col2, filter_col3, filter_col4 = st.columns([2,2,3,2])
-    country_opts = sorted(df["locale"].dropna().apply(lambda l: l.split("-")[-1]).unique())
-    trial_opts = sorted(set([m["trial_id"] for ms in df["matches_json"].apply(json.loads) for m in ms]))
-    date_min, date_max = df["submitted_ts"].min(), df["submitted_ts"].max()
-    # Convert to python datetime for slider
-    date_min = pd.to_datetime(date_min).to_pydatetime() if pd.notnull(date_min) else datetime.utcnow()
-    date_max = pd.to_datetime(date_max).to_pydatetime() if pd.notnull(date_max) else datetime.utcnow()
-    if date_min == date_max:
-        date_max = date_min + timedelta(days=1)
     # --- Reset Filters logic ---
     if 'admin_filters' not in st.session_state:
         st.session_state.admin_filters = {
@@ -576,102 +944,69 @@ def run_admin(lang):
             'trial': 'All',
             'date': (date_min.date(), date_max.date())
         }
-    if filter_col4.button(translate(UI_TEXT['admin_reset_filters_button'], lang)):
+    if filter_col4.button(T['admin_reset_filters_button']):
         st.session_state.admin_filters = {
             'country': 'All',
             'trial': 'All',
             'date': (date_min.date(), date_max.date())
         }
         st.rerun()
-    country_f = filter_col1.selectbox(translate(UI_TEXT['admin_country_filter_label'], lang), ["All"] + country_opts, index=(["All"] + country_opts).index(st.session_state.admin_filters['country']) if st.session_state.admin_filters['country'] in (["All"] + country_opts) else 0, key="admin_country")
-    trial_f = filter_col2.selectbox(translate(UI_TEXT['admin_trial_filter_label'], lang), ["All"] + trial_opts, index=(["All"] + trial_opts).index(st.session_state.admin_filters['trial']) if st.session_state.admin_filters['trial'] in (["All"] + trial_opts) else 0, key="admin_trial")
-    date_f = filter_col3.slider(translate(UI_TEXT['admin_date_filter_label'], lang), min_value=date_min.date(), max_value=date_max.date(), value=st.session_state.admin_filters['date'], format="YYYY-MM-DD", key="admin_date")
+    country_opts = list(country_locales)
+    country_f = filter_col1.selectbox(T['admin_country_filter_label'], ["All"] + country_opts, index=(["All"] + country_opts).index(st.session_state.admin_filters['country']) if st.session_state.admin_filters['country'] in (["All"] + country_opts) else 0, key="admin_country")
+    trial_f = filter_col2.selectbox(T['admin_trial_filter_label'], ["All"] + trial_opts, index=(["All"] + trial_opts).index(st.session_state.admin_filters['trial']) if st.session_state.admin_filters['trial'] in (["All"] + trial_opts) else 0, key="admin_trial")
+    date_f = filter_col3.slider(T['admin_date_filter_label'], min_value=date_min.date(), max_value=date_max.date(), value=st.session_state.admin_filters['date'], format="YYYY-MM-DD", key="admin_date")
     # Save filter state
     st.session_state.admin_filters = {'country': country_f, 'trial': trial_f, 'date': date_f}
     # Apply filters
-    dff = df.copy()
-    if country_f != "All":
-        dff = dff[dff["locale"].apply(lambda l: l.split("-")[-1]) == country_f]
-    if trial_f != "All":
-        dff = dff[dff["matches_json"].apply(lambda ms: trial_f in [m["trial_id"] for m in json.loads(ms)])]
-    dff = dff[(pd.to_datetime(dff["submitted_ts"]).dt.date >= date_f[0]) & (pd.to_datetime(dff["submitted_ts"]).dt.date <= date_f[1])]
+    dff, trial_rows = _query_submissions(data_version, country_locales.get(country_f), trial_f, date_f)
     # --- Submissions Table ---
     st.markdown("---")
-    st.subheader(f"{translate(UI_TEXT['admin_submissions_title'], lang)} ({len(dff)})")
+    st.subheader(f"{T['admin_submissions_title']} ({len(dff)})")
     if dff.empty:
-        st.info(translate(UI_TEXT['admin_no_submissions_message'], lang))
+        st.info(T['admin_no_submissions_message'])
     else:
-        st.dataframe(dff, use_container_width=True, hide_index=True)
+        st.dataframe(dff.drop(columns=["trial_ids"]), use_container_width=True, hide_index=True)
     st.markdown("---")
-    st.subheader(translate(UI_TEXT['admin_kpis_title'], lang))
+    st.subheader(T['admin_kpis_title'])
     k1, k2, k3 = st.columns(3)
     # Fake growth for demo
     total = len(df)
     new_today = 3 if total > 0 else 0
     avg_dur = round(df["duration_sec"].mean(), 2) if not df.empty else 0
-    k1.metric(translate(UI_TEXT['admin_kpi_total_submissions'], lang), total, f"+{new_today}")
-    k2.metric(translate(UI_TEXT['admin_kpi_avg_duration'], lang), avg_dur, "+0.5")
-    k3.metric(translate(UI_TEXT['admin_kpi_completion_rate'], lang), "100%" if not df.empty else "0%", "+0%")
+    k1.metric(T['admin_kpi_total_submissions'], total, f"+{new_today}")
+    k2.metric(T['admin_kpi_avg_duration'], avg_dur, "+0.5")
+    completion_rate = df["status"].eq("complete").mean() if not df.empty else 0
+    k3.metric(T['admin_kpi_completion_rate'], f"{completion_rate:.0%}", "+0%")
     # --- Map ---
     st.markdown("---")
-    st.subheader(translate(UI_TEXT['admin_map_title'], lang))
+    st.subheader(T['admin_map_title'])
     if not dff.empty:
-        dff["country"] = dff["locale"].apply(lambda l: l.split("-")[-1] if l else "US")
-        country_counts = dff["country"].value_counts().reset_index()
-        country_counts.columns = ["country", "cnt"]
-
-        iso2_to_iso3 = {
-            'US': 'USA', 'FR': 'FRA', 'DE': 'DEU', 'ES': 'ESP', 'IN': 'IND', 'CN': 'CHN',
-            'BR': 'BRA', 'SA': 'SAU', 'GB': 'GBR', 'CA': 'CAN', 'PT': 'PRT', 'BE': 'BEL', 'AR': 'ARG'
-        }
-        country_counts["iso_alpha"] = country_counts["country"].map(iso2_to_iso3)
-        hover_text = translate(UI_TEXT['admin_map_hover_text'], lang)
-        fig = go.Figure(data=go.Scattergeo(
-            locations=country_counts['iso_alpha'],
-            locationmode='ISO-3',
-            text=country_counts.apply(lambda row: f"{row['country']}: {row['cnt']} {hover_text}", axis=1),
-            marker=dict(
-                size=country_counts['cnt'],
-                sizemin=4,
-                sizemode='diameter',
-                color='#3182ce' if st.session_state.theme == 'light' else '#2b6cb0',
-                line_width=0.5,
-                line_color='rgb(40,40,40)',
-                sizeref=country_counts['cnt'].max() / 50 if country_counts['cnt'].max() > 0 else 1,
-            ),
-            hoverinfo='text'
-        ))
-
-        fig.update_layout(
-            title=translate(UI_TEXT['admin_map_plot_title'], lang),
-            geo=dict(
-                scope='world',
-                projection_type='natural earth',
-                showland=True,
-                landcolor='rgb(217, 217, 217)' if st.session_state.theme == 'light' else 'rgb(40, 40, 40)',
-                subunitcolor='rgb(255, 255, 255)' if st.session_state.theme == 'light' else 'rgb(80, 80, 80)',
-                bgcolor='rgba(0,0,0,0)',
-            ),
-            margin={"r":0,"t":40,"l":0,"b":0},
-            template='plotly_white' if st.session_state.theme == 'light' else 'plotly_dark'
-        )
+        country_counts = dff["country"].value_counts()
+        fig = _build_map_figure(tuple(zip(country_counts.index, country_counts.tolist())), lang, st.session_state.theme)
         st.plotly_chart(fig, use_container_width=True)
     else:
-        st.info(translate(UI_TEXT['admin_map_no_data_message'], lang))
+        st.info(T['admin_map_no_data_message'])
     # --- Top Trials Drilldown ---
     st.markdown("---")
-    st.subheader(translate(UI_TEXT['admin_top_trials_title'], lang))
+    st.subheader(T['admin_top_trials_title'])
     if not dff.empty:
-        matches = pd.json_normalize(dff["matches_json"].apply(json.loads).sum())
-        top_trials = matches.groupby("trial_id").size().sort_values(ascending=False).head(3)
+        # Counts come straight from the inverted index's row lists.
+        top_trials = pd.Series({t: len(r) for t, r in trial_rows.items()}, name="count", dtype="int64").nlargest(3).rename_axis("trial_id")
         st.write(top_trials)
-        trial_drill = st.selectbox(translate(UI_TEXT['admin_top_trials_drilldown_label'], lang), ["None"] + list(top_trials.index))
+        trial_drill = st.selectbox(T['admin_top_trials_drilldown_label'], ["None"] + list(top_trials.index))
         if trial_drill != "None":
-            users = dff[dff["matches_json"].apply(lambda ms: trial_drill in [m["trial_id"] for m in json.loads(ms)])]
-            for idx, row in users.iterrows():
-                st.markdown(f"<details><summary><b>{row['submitted_ts']} | {row['locale']}</b></summary><pre style='white-space:pre-wrap;'>{json.dumps(json.loads(row['responses_json']), indent=2, ensure_ascii=False)}</pre></details>", unsafe_allow_html=True)
+            users = dff.iloc[trial_rows.get(trial_drill, [])]
+            if st.session_state.get("_drill_trial") != trial_drill:
+                st.session_state._drill_trial = trial_drill
+                st.session_state._drill_limit = _DRILL_PAGE
+            shown = users.head(st.session_state._drill_limit)
+            responses_by_id = _load_responses(tuple(shown["submission_id"]))
+            for row in shown.itertuples(index=False):
+                st.markdown(f"<details><summary><b>{row.submitted_ts} | {row.locale}</b></summary><pre style='white-space:pre-wrap;'>{responses_by_id[row.submission_id]}</pre></details>", unsafe_allow_html=True)
+            if len(users) > len(shown):
+                st.button(T['admin_drilldown_show_more'], on_click=_show_more_drilldown)
     else:
-        st.info(translate(UI_TEXT['admin_top_trials_no_matches_message'], lang))
+        st.info(T['admin_top_trials_no_matches_message'])
 
 # --- Main App ---
 if menu == "Patient":